@@ -14,44 +14,71 @@ Cursor Agent CLI 参考：
 from __future__ import annotations
 
 import argparse
+import functools
 import os
+import re
 import shlex
+import shutil
 import subprocess
 import sys
+import tempfile
 import time
 from pathlib import Path
 
 DEFAULT_AGENT_BIN = os.environ.get("AGENT_BIN", "agent")
 
 
+@functools.lru_cache(maxsize=32)
 def which(name: str) -> str | None:
-    """Search PATH for an executable."""
-    paths = os.environ.get("PATH", "").split(":")
-    for p in paths:
-        cand = Path(p) / name
-        try:
-            if cand.is_file() and os.access(cand, os.X_OK):
-                return str(cand)
-        except OSError:
-            pass
-    return None
+    """Search PATH for an executable (cached per name)."""
+    return shutil.which(name)
+
+
+# 行首（可有空白）的单个 "/"，排除 "//" 注释。
+# 行边界与 str.splitlines() 一致，空白与 str.strip() 一致；行首空白不含换行符，
+# 保证扫描是线性的。字符串开头单独用 match，使 search 的模式以字符集开头，
+# 可走 re 的快速前缀扫描。
+_LINE_BREAKS = r"\n\r\v\f\x1c-\x1e\x85\u2028\u2029"
+_SLASH_AT_START_RE = re.compile(rf"[^\S{_LINE_BREAKS}]*/(?!/)")
+_SLASH_AFTER_BREAK_RE = re.compile(rf"[{_LINE_BREAKS}][^\S{_LINE_BREAKS}]*/(?!/)")
 
 
 def looks_like_slash_commands(prompt: str | None) -> bool:
     """Detect if the prompt contains interactive slash commands."""
-    if not prompt:
+    if not prompt or "/" not in prompt:
         return False
-    for line in prompt.splitlines():
-        stripped = line.strip()
-        if stripped.startswith("/") and not stripped.startswith("//"):
-            return True
-    return False
+    return (
+        _SLASH_AT_START_RE.match(prompt) is not None
+        or _SLASH_AFTER_BREAK_RE.search(prompt) is not None
+    )
+
+
+def build_agent_options(args: argparse.Namespace, workspace: str | None) -> list[str]:
+    """Build the agent options shared by headless and interactive modes.
+
+    [--model X] [--yolo] [--mode M] [--workspace W]
+    """
+    opts: list[str] = []
+
+    if args.model:
+        opts += ["--model", args.model]
+
+    if args.yolo:
+        opts.append("--yolo")
+
+    if args.mode:
+        opts += ["--mode", args.mode]
+
+    if workspace:
+        opts += ["--workspace", workspace]
+
+    return opts
 
 
 def build_headless_cmd(args: argparse.Namespace) -> list[str]:
     """Build the CLI command for headless (non-interactive) execution.
 
-    agent -p "prompt" --trust --output-format text [--model X] [--workspace W] [--yolo]
+    agent -p --trust --output-format text [--model X] [--yolo] [--mode M] [--workspace W] "prompt"
     """
     cmd: list[str] = [args.agent_bin]
 
@@ -64,19 +91,7 @@ def build_headless_cmd(args: argparse.Namespace) -> list[str]:
     if args.output_format:
         cmd += ["--output-format", args.output_format]
 
-    if args.model:
-        cmd += ["--model", args.model]
-
-    if args.workspace:
-        cmd += ["--workspace", args.workspace]
-    elif args.cwd:
-        cmd += ["--workspace", args.cwd]
-
-    if args.yolo:
-        cmd.append("--yolo")
-
-    if args.mode:
-        cmd += ["--mode", args.mode]
+    cmd += build_agent_options(args, args.workspace or args.cwd)
 
     # prompt 作为位置参数放最后
     if args.prompt:
@@ -88,23 +103,48 @@ def build_headless_cmd(args: argparse.Namespace) -> list[str]:
     return cmd
 
 
-def run_with_pty(cmd: list[str], cwd: str | None, env: dict[str, str] | None = None) -> int:
-    """Run command inside a PTY via script(1) to prevent hanging."""
+def build_interactive_cmd(args: argparse.Namespace, cwd: str) -> list[str]:
+    """Build the CLI command launched inside tmux.
+
+    agent [--model X] [--yolo] [--mode M] --workspace W
+    """
+    cmd: list[str] = [args.agent_bin]
+    cmd += build_agent_options(args, cwd)
+
+    if args.extra:
+        cmd += args.extra
+
+    return cmd
+
+
+def exec_with_pty(cmd: list[str], cwd: str | None, env: dict[str, str] | None = None) -> int:
+    """Replace this process with script(1) running cmd in a PTY to prevent hanging.
+
+    env replaces the environment entirely; None inherits the current one.
+    Only returns (with an exit code) if exec fails.
+    """
     cmd_str = " ".join(shlex.quote(c) for c in cmd)
 
+    if cwd:
+        os.chdir(cwd)
+
     script_bin = which("script")
-    if not script_bin:
+    if script_bin:
+        argv = [script_bin, "-q", "-c", cmd_str, "/dev/null"]
+    else:
         print("[runner] script(1) not found, running directly", file=sys.stderr)
-        proc = subprocess.run(cmd, cwd=cwd, text=True, env=env)
-        return proc.returncode
-
-    proc = subprocess.run(
-        [script_bin, "-q", "-c", cmd_str, "/dev/null"],
-        cwd=cwd,
-        text=True,
-        env=env,
-    )
-    return proc.returncode
+        argv = cmd
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        if env is None:
+            os.execvp(argv[0], argv)
+        else:
+            os.execvpe(argv[0], argv, env)
+    except OSError as e:
+        print(f"[runner] failed to exec {argv[0]}: {e}", file=sys.stderr)
+        return 127
 
 
 # ---- tmux 交互模式 ----
@@ -113,27 +153,87 @@ def tmux_cmd(socket_path: str, *args: str) -> list[str]:
     return ["tmux", "-S", socket_path, *args]
 
 
-def tmux_capture(socket_path: str, target: str, lines: int = 200) -> str:
-    out = subprocess.check_output(
-        tmux_cmd(socket_path, "capture-pane", "-p", "-J", "-t", target, "-S", f"-{lines}"),
-        text=True,
+def tmux_chain(socket_path: str, *commands: list[str]) -> list[str]:
+    """Join several tmux commands with `;` so they run in one invocation."""
+    args: list[str] = []
+    for c in commands:
+        if args:
+            args.append(";")
+        args += c
+    return tmux_cmd(socket_path, *args)
+
+
+def send_keys_line(target: str, text: str) -> list[list[str]]:
+    """tmux commands that type text literally and press Enter.
+
+    `-l` 会把其后所有参数当作字面文本，因此 Enter 需要拆成第二条命令。
+    """
+    return [
+        ["send-keys", "-t", target, "-l", "--", text],
+        ["send-keys", "-t", target, "Enter"],
+    ]
+
+
+def send_line(socket_path: str, target: str, text: str, check: bool = True) -> None:
+    """Type text literally and press Enter in a single tmux invocation."""
+    subprocess.run(
+        tmux_chain(socket_path, *send_keys_line(target, text)),
+        check=check,
     )
-    return out
+
+
+def tmux_capture_to(
+    fd: int, socket_path: str, target: str, lines: int = 200,
+    header: str | None = None, timeout_s: float = 5.0,
+) -> None:
+    """Stream the last N lines of a pane straight into file descriptor `fd`.
+
+    header 由 tmux 在确认目标存在后输出，capture 失败时不会单独打印。
+    始终使用有界的 `-S -N`，避免 `-S -` 在超长历史上卡住；tmux 超时未响应则放弃。
+    """
+    commands: list[list[str]] = []
+    if header is not None:
+        # has-session 失败会中断后续命令；display-message 的 `#` 需转义
+        commands += [
+            ["has-session", "-t", target],
+            ["display-message", "-p", header.replace("#", "##")],
+        ]
+    commands.append(["capture-pane", "-p", "-J", "-t", target, "-S", f"-{lines}"])
+    try:
+        subprocess.run(
+            tmux_chain(socket_path, *commands),
+            stdout=fd, timeout=timeout_s, check=True,
+        )
+    except subprocess.TimeoutExpired:
+        # subprocess.run 在超时时已 kill 子进程
+        pass
 
 
 def tmux_wait_for_text(
-    socket_path: str, target: str, pattern: str,
-    timeout_s: int = 30, poll_s: float = 0.5,
+    log_path: str, pattern: str,
+    timeout_s: float = 30, poll_s: float = 0.5, offset: int = 0,
 ) -> bool:
+    """Wait for pattern in the pane log written by `tmux pipe-pane`.
+
+    从 offset 起只读取新增字节，保留最近 8 KiB 用于跨块匹配，不再反复 capture-pane。
+    """
+    needle = pattern.encode()
+    keep = 8192
+    buf = b""
     deadline = time.time() + timeout_s
-    while time.time() < deadline:
-        try:
-            buf = tmux_capture(socket_path, target, lines=200)
-            if pattern in buf:
+    fd = os.open(log_path, os.O_RDONLY)
+    try:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while time.time() < deadline:
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                time.sleep(poll_s)
+                continue
+            buf = (buf + chunk)[-keep:]
+            if needle in buf:
                 return True
-        except subprocess.CalledProcessError:
-            pass
-        time.sleep(poll_s)
+    finally:
+        os.close(fd)
     return False
 
 
@@ -156,53 +256,73 @@ def run_interactive_tmux(args: argparse.Namespace) -> int:
     session = args.tmux_session
     target = f"{session}:0.0"
 
-    subprocess.run(
-        tmux_cmd(socket_path, "kill-session", "-t", session),
-        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-    )
-    subprocess.check_call(
-        tmux_cmd(socket_path, "new", "-d", "-s", session, "-n", "shell"),
-    )
-
     cwd = args.workspace or args.cwd or os.getcwd()
 
-    # 构建交互模式命令: agent "prompt" --model X --workspace W
-    agent_parts: list[str] = [args.agent_bin]
-    if args.model:
-        agent_parts += ["--model", args.model]
-    if args.yolo:
-        agent_parts.append("--yolo")
-    if args.mode:
-        agent_parts += ["--mode", args.mode]
-    agent_parts += ["--workspace", cwd]
-    if args.extra:
-        agent_parts += args.extra
+    launch = " ".join(shlex.quote(p) for p in build_interactive_cmd(args, cwd))
 
-    launch = " ".join(shlex.quote(p) for p in agent_parts)
-    subprocess.check_call(
-        tmux_cmd(socket_path, "send-keys", "-t", target, "-l", "--", launch),
-    )
-    subprocess.check_call(
-        tmux_cmd(socket_path, "send-keys", "-t", target, "Enter"),
+    # kill-session 在会话不存在时会报错并中断后续命令，故单独执行
+    subprocess.run(
+        tmux_cmd(socket_path, "kill-session", "-t", session),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
     )
 
-    # 等待 workspace trust prompt
-    if tmux_wait_for_text(socket_path, target, "trust", timeout_s=20):
-        subprocess.run(tmux_cmd(socket_path, "send-keys", "-t", target, "y"), check=False)
-        subprocess.run(tmux_cmd(socket_path, "send-keys", "-t", target, "Enter"), check=False)
-        time.sleep(0.8)
-
-    # 发送 prompt（交互模式下作为第一条消息输入）
-    if args.prompt:
-        time.sleep(2)
-        for line in [ln for ln in args.prompt.splitlines() if ln.strip()]:
-            subprocess.check_call(
-                tmux_cmd(socket_path, "send-keys", "-t", target, "-l", "--", line),
+    # 一次 tmux 调用完成：建会话、pane 输出写日志（供等待逻辑增量读取）、启动 agent
+    # 日志含完整终端输出（prompt、代码）：放在 mkdtemp 创建的私有目录（0700）中，
+    # 不使用共享 socket 目录下可预测的路径，避免被预置的符号链接劫持
+    log_dir = tempfile.mkdtemp(prefix="cursor-dispatch-")
+    log_path = os.path.join(log_dir, "pane.log")
+    os.close(os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+    try:
+        subprocess.check_call(
+            tmux_chain(
+                socket_path,
+                ["new", "-d", "-s", session, "-n", "shell"],
+                ["pipe-pane", "-o", "-t", target, f"cat >> {shlex.quote(log_path)}"],
+                *send_keys_line(target, launch),
+            ),
+        )
+
+        # 等待 workspace trust prompt
+        ready_wait_s = 2.0
+        if tmux_wait_for_text(log_path, "trust", timeout_s=20):
+            send_line(socket_path, target, "y", check=False)
+            ready_wait_s = 2.8
+        since = os.path.getsize(log_path)
+
+        # 发送 prompt（交互模式下作为第一条消息输入）
+        # 无法从输出静默判断 agent 是否就绪，默认保留原先的固定等待；
+        # 指定 --interactive-ready-text 时，看到该文本即可提前粘贴，等待上限不变
+        # 整段写入 tmux buffer 后一次性粘贴（paste-buffer 会把换行转成 Enter）
+        if args.prompt:
+            if args.interactive_ready_text:
+                tmux_wait_for_text(
+                    log_path, args.interactive_ready_text,
+                    timeout_s=ready_wait_s, poll_s=0.1, offset=since,
+                )
+            else:
+                time.sleep(ready_wait_s)
+            body = "\n".join(ln for ln in args.prompt.splitlines() if ln.strip())
+            # buffer 名按会话区分，避免共享 socket 的并发 runner 互相粘贴
+            buffer_name = f"{session}-prompt"
+            subprocess.run(
+                tmux_chain(
+                    socket_path,
+                    ["load-buffer", "-b", buffer_name, "-"],
+                    ["paste-buffer", "-b", buffer_name, "-d", "-t", target],
+                ),
+                input=body.encode("utf-8"), check=True,
             )
+            time.sleep(args.interactive_send_delay_ms / 1000.0)
             subprocess.check_call(
                 tmux_cmd(socket_path, "send-keys", "-t", target, "Enter"),
             )
-            time.sleep(args.interactive_send_delay_ms / 1000.0)
+    finally:
+        # prompt 已送达，停止 pipe-pane 并删除日志，避免长期增长和泄露
+        subprocess.run(
+            tmux_cmd(socket_path, "pipe-pane", "-t", target),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        shutil.rmtree(log_dir, ignore_errors=True)
 
     print("[runner] Started interactive Cursor Agent in tmux.")
     print(f"  Monitor:  tmux -S {shlex.quote(socket_path)} attach -t {shlex.quote(session)}")
@@ -210,10 +330,12 @@ def run_interactive_tmux(args: argparse.Namespace) -> int:
 
     if args.interactive_wait_s > 0:
         time.sleep(args.interactive_wait_s)
+        sys.stdout.flush()
         try:
-            snap = tmux_capture(socket_path, target, lines=200)
-            print("\n--- tmux snapshot (last 200 lines) ---\n")
-            print(snap)
+            tmux_capture_to(
+                sys.stdout.fileno(), socket_path, target, lines=200,
+                header="\n--- tmux snapshot (last 200 lines) ---\n",
+            )
         except subprocess.CalledProcessError:
             pass
 
@@ -258,7 +380,11 @@ def main() -> int:
     ap.add_argument("--tmux-socket-dir", default=None, help="tmux socket directory")
     ap.add_argument("--tmux-socket-name", default="cursor-agent.sock", help="tmux socket file")
     ap.add_argument("--interactive-wait-s", type=int, default=0, help="Wait N seconds then print tmux snapshot")
-    ap.add_argument("--interactive-send-delay-ms", type=int, default=800, help="Delay between sending lines in interactive mode")
+    ap.add_argument(
+        "--interactive-ready-text", default=None,
+        help="Text the agent UI shows when ready for input; paste the prompt as soon as it appears",
+    )
+    ap.add_argument("--interactive-send-delay-ms", type=int, default=800, help="Delay between pasting the prompt and submitting it in interactive mode")
 
     ap.add_argument("extra", nargs=argparse.REMAINDER, help="Extra args after --")
 
@@ -271,22 +397,22 @@ def main() -> int:
 
     # 检测 agent 可执行文件
     agent_path = which(args.agent_bin)
-    if not agent_path and not Path(args.agent_bin).exists():
+    if not agent_path and not os.path.exists(args.agent_bin):
         print(f"[runner] agent binary not found: {args.agent_bin}", file=sys.stderr)
         print("Tip: install via `curl https://cursor.com/install -fsS | bash`", file=sys.stderr)
         print("  or set AGENT_BIN=/path/to/agent", file=sys.stderr)
         return 2
 
+    # 仅 auto 模式才扫描 prompt
     mode = args.run_mode
-    if mode == "auto" and looks_like_slash_commands(args.prompt):
-        mode = "interactive"
+    if mode == "auto":
+        mode = "interactive" if looks_like_slash_commands(args.prompt) else "headless"
 
     if mode == "interactive":
         return run_interactive_tmux(args)
 
     cmd = build_headless_cmd(args)
-    env = os.environ.copy()
-    return run_with_pty(cmd, cwd=args.cwd, env=env)
+    return exec_with_pty(cmd, cwd=args.cwd, env=None)
 
 
 if __name__ == "__main__":